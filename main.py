@@ -1,8 +1,10 @@
 import os
 import time
 import json
+import logging
 from binance_client import BinanceClient
 from binance_graph import BinanceGraph
+from profiling import CycleProfiler, REPLAY_PNL, REPLAY_SCAN, DEFAULT_DUMP_DIR, DEFAULT_MAX_DUMPS
 from typing import List
 
 INFINITY = float('inf')
@@ -11,6 +13,32 @@ GRAPH_FILE = "./binance_graph.json"
 RAW_TICKERS_FILE = "./raw_tickers.json"
 ORDER_BOOKS_FILE = "./order_books.json"
 
+logger = logging.getLogger(__name__)
+
+def _read_profile_setting(name: str, cast, default=None):
+    """
+    Read a non-negative profiling setting from an environment variable.
+    Returns default if the variable is unset or invalid; invalid values are logged.
+    A default of None leaves profiling disabled.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        number = None
+    if number is None or not number >= 0:
+        fallback = "profiling disabled" if default is None else f"using {default}"
+        logger.error(f"Ignoring invalid {name}={value!r}, expected a number >= 0 ({fallback})")
+        return default
+    return number
+
+# Cycles slower than this are dumped with their sampled stacks and inputs; unset disables profiling
+PROFILE_LATENCY_BUDGET_MS = _read_profile_setting("PROFILE_LATENCY_BUDGET_MS", float)
+PROFILE_DUMP_DIR = os.environ.get("PROFILE_DUMP_DIR", DEFAULT_DUMP_DIR)
+PROFILE_MAX_DUMPS = _read_profile_setting("PROFILE_MAX_DUMPS", int, DEFAULT_MAX_DUMPS)  # per run
+
 def main():
     # bc = BinanceClient()
     # Create the weighted graph
@@ -91,27 +119,34 @@ def debug_depth():
     path = ['USDT', 'BNB', 'ENA', 'USDT']
     initial_amount = 100  # 10000 USDT
     
-    # Get and save order books
-    order_books = bc.get_order_books_for_path(path, limit=100, file_path=ORDER_BOOKS_FILE)  # This will save to order_books.json
-    
-    # if not order_books:
-    #     print("Failed to fetch order books")
-    #     exit(1)
-    
-    # For debugging: Load from file
-    loaded_data = bc.load_order_books(ORDER_BOOKS_FILE)
-    if loaded_data:
-        print("\nLoaded order books data:")
-        print(f"Path: {loaded_data['path']}")
-        print("\nOrder Books:")
-        for symbol, book in loaded_data['order_books'].items():
-            print(f"\n{symbol}:")
-            print("Top 3 Bids:", book['bids'][:3])
-            print("Top 3 Asks:", book['asks'][:3])
-        
-        # Calculate PnL using loaded order books
-        pnl = graph.compute_pnl_arbitrage(path=path, amount=initial_amount, order_books=loaded_data['order_books'])
-        print(f"\nExpected PnL: {pnl}%")
+    profiler = CycleProfiler(PROFILE_LATENCY_BUDGET_MS, PROFILE_DUMP_DIR, max_dumps=PROFILE_MAX_DUMPS)
+    with profiler.cycle("debug_depth") as cycle:
+        cycle.record(replay=REPLAY_PNL, graph=graph, path=path, amount=initial_amount)
+
+        with cycle.phase("fetch"):
+            # Get and save order books
+            order_books = bc.get_order_books_for_path(path, limit=100, file_path=ORDER_BOOKS_FILE)  # This will save to order_books.json
+            
+            # if not order_books:
+            #     print("Failed to fetch order books")
+            #     exit(1)
+            
+            # For debugging: Load from file
+            loaded_data = bc.load_order_books(ORDER_BOOKS_FILE)
+        if loaded_data:
+            cycle.record(order_books=loaded_data['order_books'])
+            print("\nLoaded order books data:")
+            print(f"Path: {loaded_data['path']}")
+            print("\nOrder Books:")
+            for symbol, book in loaded_data['order_books'].items():
+                print(f"\n{symbol}:")
+                print("Top 3 Bids:", book['bids'][:3])
+                print("Top 3 Asks:", book['asks'][:3])
+            
+            # Calculate PnL using loaded order books
+            with cycle.phase("compute"):
+                pnl = graph.compute_pnl_arbitrage(path=path, amount=initial_amount, order_books=loaded_data['order_books'])
+            print(f"\nExpected PnL: {pnl}%")
 
 def find_profitable_arbitrage():
     """
@@ -119,8 +154,14 @@ def find_profitable_arbitrage():
     then try to compute pnl for each one
     """
     bc = BinanceClient()
-    graph = bc.create_weighted_graph()
-    opportunities = graph.find_all_triangular_arbitrage(min_profit=1.0001)
+    profiler = CycleProfiler(PROFILE_LATENCY_BUDGET_MS, PROFILE_DUMP_DIR, max_dumps=PROFILE_MAX_DUMPS)
+    min_profit = 1.0001
+    with profiler.cycle("find_all_triangular_arbitrage") as cycle:
+        with cycle.phase("fetch"):
+            graph = bc.create_weighted_graph()
+        cycle.record(replay=REPLAY_SCAN, graph=graph, min_profit=min_profit)
+        with cycle.phase("compute"):
+            opportunities = graph.find_all_triangular_arbitrage(min_profit=min_profit)
     for opp in opportunities:
         # print(f"{opp[0]} -> {opp[1]} -> {opp[2]} -> {opp[0]}: Profit = {opp[3]:.2f}%")
         # print(opp)
@@ -129,10 +170,16 @@ def find_profitable_arbitrage():
         print("Path: ", path)
         print("Type of path: ", type(path))
         
-        pnl = graph.compute_pnl_arbitrage(
-            path=opp[:3]+opp[:0], 
-            amount=1000, 
-            order_books=bc.get_order_books_for_path([*opp[:3],opp[0]], limit=100, file_path=None))
+        with profiler.cycle("find_profitable_arbitrage") as cycle:
+            cycle.record(replay=REPLAY_PNL, graph=graph, path=opp[:3]+opp[:0], amount=1000)
+            with cycle.phase("fetch"):
+                order_books = bc.get_order_books_for_path([*opp[:3],opp[0]], limit=100, file_path=None)
+            cycle.record(order_books=order_books)
+            with cycle.phase("compute"):
+                pnl = graph.compute_pnl_arbitrage(
+                    path=opp[:3]+opp[:0], 
+                    amount=1000, 
+                    order_books=order_books)
         time.sleep(0.3)
         if pnl > 0:
             print("Opportunity found: ", opp[:3])
@@ -0,0 +1,336 @@
+import json
+import os
+import sys
+import threading
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from types import CodeType
+from typing import Dict, List, Tuple, Iterable, Optional, Any
+from binance_graph import BinanceGraph
+
+logger = logging.getLogger(__name__)
+DEFAULT_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+DEFAULT_DUMP_DIR = './profiles'
+DEFAULT_MAX_DUMPS = 20  # per CycleProfiler, i.e. per run
+REPLAY_PNL = 'pnl'
+REPLAY_SCAN = 'scan'
+STACKS_FILE = 'stacks.folded'
+REPLAY_STACKS_FILE = 'replay.folded'
+ORDER_BOOKS_SNAPSHOT_FILE = 'order_books.json'
+CYCLE_INFO_FILE = 'cycle.json'
+
+
+class SamplingProfiler:
+    """
+    Stack sampling profiler for a single thread.
+
+    A background thread periodically grabs the target thread's current frame and
+    counts the call stacks it sees. The result is exported in the collapsed
+    ("folded") format understood by flamegraph.pl, speedscope and inferno.
+    Stacks passing through ignored_codes (the profiler's own start/stop
+    bookkeeping) are dropped so they do not show up in the flamegraph.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL, ignored_codes: Iterable[CodeType] = ()):
+        self.interval = interval
+        self.ignored_codes = {SamplingProfiler.stop.__code__, *ignored_codes}
+        self.samples: Counter = Counter()
+        self._target_thread_id: Optional[int] = None
+        self._stop_event = threading.Event()
+        self._sampler_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.samples.clear()
+        self._target_thread_id = threading.get_ident()
+        self._stop_event.clear()
+        self._sampler_thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._sampler_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._sampler_thread is not None:
+            self._sampler_thread.join()
+            self._sampler_thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is not None:
+                stack = self._collapse(frame)
+                if stack is not None:
+                    self.samples[stack] += 1
+
+    def _collapse(self, frame) -> Optional[str]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            if code in self.ignored_codes:
+                return None
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def collapsed_stacks(self) -> List[str]:
+        return [f"{stack} {count}" for stack, count in self.samples.most_common()]
+
+    def save_collapsed_stacks(self, file_path: str):
+        with open(file_path, 'w') as f:
+            f.write("\n".join(self.collapsed_stacks()) + "\n")
+
+
+class ProfiledCycle:
+    """Inputs and phase timings of a single scan cycle, kept so a slow cycle can be replayed offline."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.replay: Optional[str] = None
+        self.graph: Optional[BinanceGraph] = None
+        self.order_books: Optional[Dict[str, Dict]] = None
+        self.path: Optional[List[str]] = None
+        self.params: Dict[str, Any] = {}
+        self.timings: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.elapsed_ms: float = 0.0
+
+    def record(self, replay: Optional[str] = None, graph: Optional[BinanceGraph] = None,
+               order_books: Optional[Dict[str, Dict]] = None, path: Optional[List[str]] = None, **params):
+        """
+        Record the inputs of the cycle.
+
+        Args:
+            replay: How to replay the cycle, REPLAY_PNL (compute_pnl_arbitrage) or REPLAY_SCAN (find_all_triangular_arbitrage)
+            graph: Graph the cycle works on
+            order_books: Order books used to compute the PnL
+            path: Arbitrage path passed to compute_pnl_arbitrage
+            params: Extra scalar arguments needed for the replay (e.g. amount, min_profit)
+        """
+        if replay is not None:
+            self.replay = replay
+        if graph is not None:
+            self.graph = graph
+        if order_books is not None:
+            self.order_books = order_books
+        if path is not None:
+            self.path = list(path)
+        self.params.update(params)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time a phase of the cycle, e.g. 'fetch' for network I/O or 'compute' for the part a replay re-runs.
+        The duration is stored in timings as '<name>_ms'.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            key = f"{name}_ms"
+            self.timings[key] = self.timings.get(key, 0.0) + (time.perf_counter() - start) * 1000
+
+
+class CycleProfiler:
+    """
+    Profile scan cycles and dump the ones exceeding a latency budget.
+
+    Every cycle is sampled while it runs; only cycles slower than budget_ms are
+    written to dump_dir, together with the graph snapshot and order books that
+    triggered them. Cycles that raise are dumped as well. All dumps of one
+    profiler go to a single run directory, each graph object is snapshotted
+    only once per run, and at most max_dumps cycles are written.
+    A budget of None disables profiling entirely.
+    """
+
+    def __init__(self, budget_ms: Optional[float], dump_dir: str = DEFAULT_DUMP_DIR,
+                 interval: float = DEFAULT_SAMPLE_INTERVAL, max_dumps: int = DEFAULT_MAX_DUMPS):
+        self.budget_ms = budget_ms
+        self.dump_dir = dump_dir
+        self.interval = interval
+        self.max_dumps = max_dumps
+        self.dump_count = 0
+        self._run_path: Optional[str] = None
+        self._graph_snapshots: List[Tuple[BinanceGraph, str]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_ms is not None
+
+    @contextmanager
+    def cycle(self, name: str):
+        cycle = ProfiledCycle(name)
+        if not self.enabled:
+            yield cycle
+            return
+
+        # Samples taken while this generator runs its own setup or cleanup are not scanner work
+        profiler = SamplingProfiler(self.interval, ignored_codes=(CycleProfiler.cycle.__wrapped__.__code__,))
+        profiler.start()
+        start = time.perf_counter()
+        try:
+            yield cycle
+        except Exception as e:
+            cycle.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            cycle.elapsed_ms = (time.perf_counter() - start) * 1000
+            profiler.stop()
+            if cycle.elapsed_ms > self.budget_ms:
+                self._handle_slow_cycle(cycle, profiler)
+
+    def _handle_slow_cycle(self, cycle: ProfiledCycle, profiler: SamplingProfiler):
+        if self.dump_count >= self.max_dumps:
+            logger.debug(f"Cycle {cycle.name} took {cycle.elapsed_ms:.1f} ms, dump limit of {self.max_dumps} reached")
+            return
+
+        dump_path = self._dump(cycle, profiler, self.dump_count + 1)
+        if dump_path is None:
+            return
+
+        self.dump_count += 1
+        logger.warning(f"Cycle {cycle.name} took {cycle.elapsed_ms:.1f} ms "
+                       f"(budget {self.budget_ms} ms), profile saved to {dump_path}")
+        if self.dump_count == self.max_dumps:
+            logger.warning(f"Reached the limit of {self.max_dumps} profile dumps, further slow cycles are not saved")
+
+    def _graph_snapshot(self, graph: BinanceGraph) -> str:
+        """
+        Save the graph once per run and return the snapshot file.
+        The graph is assumed not to change after its first snapshot.
+        """
+        for snapshot_graph, file_path in self._graph_snapshots:
+            if snapshot_graph is graph:
+                return file_path
+
+        file_path = os.path.join(self._run_path, f"graph_{len(self._graph_snapshots) + 1}.json")
+        graph.save_to_json(file_path)
+        self._graph_snapshots.append((graph, file_path))
+        return file_path
+
+    def _dump(self, cycle: ProfiledCycle, profiler: SamplingProfiler, index: int) -> Optional[str]:
+        """
+        Write the collapsed stacks and the inputs of a slow cycle to a new directory.
+
+        Args:
+            cycle: The slow cycle
+            profiler: Sampler that ran during the cycle
+            index: Sequence number of the dump within the run, used in the directory name
+
+        Returns:
+            The dump directory, or None if it could not be written
+        """
+        if self._run_path is None:
+            self._run_path = os.path.join(self.dump_dir, f"run_{int(time.time() * 1000)}")
+        dump_path = os.path.join(self._run_path, f"{index:03d}_{cycle.name}")
+        try:
+            os.makedirs(dump_path, exist_ok=True)
+            profiler.save_collapsed_stacks(os.path.join(dump_path, STACKS_FILE))
+
+            graph_file = None
+            if cycle.graph is not None:
+                graph_file = os.path.relpath(self._graph_snapshot(cycle.graph), dump_path)
+
+            if cycle.order_books is not None:
+                # Same layout as BinanceClient._save_order_books so load_order_books can read it
+                with open(os.path.join(dump_path, ORDER_BOOKS_SNAPSHOT_FILE), 'w') as f:
+                    json.dump({
+                        'timestamp': int(time.time()),
+                        'path': cycle.path,
+                        'order_books': cycle.order_books
+                    }, f, indent=2)
+
+            with open(os.path.join(dump_path, CYCLE_INFO_FILE), 'w') as f:
+                json.dump({
+                    'name': cycle.name,
+                    'replay': cycle.replay,
+                    'elapsed_ms': cycle.elapsed_ms,
+                    'timings': cycle.timings,
+                    'budget_ms': self.budget_ms,
+                    'error': cycle.error,
+                    'samples': sum(profiler.samples.values()),
+                    'graph_file': graph_file,
+                    'path': cycle.path,
+                    'params': cycle.params
+                }, f, indent=2)
+        except Exception as e:
+            logger.error(f"Failed to save profile of cycle {cycle.name} ({cycle.elapsed_ms:.1f} ms): {e}")
+            return None
+        return dump_path
+
+
+def replay_cycle(dump_path: str, interval: float = DEFAULT_SAMPLE_INTERVAL) -> Any:
+    """
+    Replay a dumped cycle offline from its graph snapshot and order books.
+
+    REPLAY_PNL cycles are replayed through compute_pnl_arbitrage, REPLAY_SCAN cycles
+    through find_all_triangular_arbitrage. No network access is needed, so the replay
+    time is compared with the recorded compute time of the cycle, not its total time.
+    The replay is profiled as well and its stacks are written next to the original ones.
+
+    Args:
+        dump_path: Directory written by CycleProfiler for a slow cycle
+
+    Returns:
+        The PnL percentage, or the list of opportunities for scan cycles
+
+    Raises:
+        ValueError: If the dump does not contain the inputs needed for a replay
+    """
+    with open(os.path.join(dump_path, CYCLE_INFO_FILE), 'r') as f:
+        info = json.load(f)
+    replay, params = info.get('replay'), info['params']
+
+    if replay not in (REPLAY_PNL, REPLAY_SCAN):
+        raise ValueError(f"Cycle {info['name']} has no replay kind recorded, it cannot be replayed")
+    if info.get('graph_file') is None:
+        raise ValueError(f"Cycle {info['name']} has no graph snapshot, it cannot be replayed")
+
+    order_books = None
+    if replay == REPLAY_PNL:
+        order_books_file = os.path.join(dump_path, ORDER_BOOKS_SNAPSHOT_FILE)
+        if not os.path.exists(order_books_file) or info.get('path') is None or 'amount' not in params:
+            raise ValueError(f"Cycle {info['name']} has no order books, path or amount recorded, "
+                             f"it cannot be replayed (error: {info.get('error')})")
+        with open(order_books_file, 'r') as f:
+            order_books = json.load(f)['order_books']
+    elif 'min_profit' not in params:
+        raise ValueError(f"Cycle {info['name']} has no min_profit recorded, it cannot be replayed")
+
+    graph = BinanceGraph.load_from_json(os.path.join(dump_path, info['graph_file']))
+
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+    start = time.perf_counter()
+    try:
+        if replay == REPLAY_PNL:
+            result = graph.compute_pnl_arbitrage(path=info['path'], amount=params['amount'], order_books=order_books)
+        else:
+            result = graph.find_all_triangular_arbitrage(min_profit=params['min_profit'])
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        profiler.stop()
+
+    profiler.save_collapsed_stacks(os.path.join(dump_path, REPLAY_STACKS_FILE))
+    compute_ms = info.get('timings', {}).get('compute_ms')
+    if compute_ms is None:
+        print(f"Replayed {info['name']}: {elapsed_ms:.1f} ms (original compute time not recorded)")
+    else:
+        print(f"Replayed {info['name']}: {elapsed_ms:.1f} ms compute "
+              f"(original compute {compute_ms:.1f} ms of {info['elapsed_ms']:.1f} ms total)")
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2:
+        print(f"Usage: python {sys.argv[0]} <dump_dir>")
+        sys.exit(1)
+    try:
+        result = replay_cycle(sys.argv[1])
+    except ValueError as e:
+        print(f"Cannot replay {sys.argv[1]}: {e}")
+        sys.exit(1)
+    if isinstance(result, list):
+        print(f"Opportunities found: {len(result)}")
+    else:
+        print(f"PnL: {result}%")
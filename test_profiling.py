@@ -0,0 +1,111 @@
+import json
+import os
+import time
+import pytest
+from binance_graph import BinanceGraph
+from profiling import CycleProfiler, replay_cycle, REPLAY_PNL, REPLAY_SCAN, STACKS_FILE, CYCLE_INFO_FILE
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+GRAPH_FILE = os.path.join(REPO_DIR, "binance_graph.json")
+ORDER_BOOKS_FILE = os.path.join(REPO_DIR, "order_books.json")
+MIN_PROFIT = 1.0001
+AMOUNT = 100
+
+
+@pytest.fixture(scope="module")
+def graph():
+    return BinanceGraph.load_from_json(GRAPH_FILE)
+
+
+@pytest.fixture(scope="module")
+def order_books_data():
+    with open(ORDER_BOOKS_FILE, 'r') as f:
+        return json.load(f)
+
+
+def dump_dirs(profiler):
+    if profiler._run_path is None:
+        return []
+    return sorted(os.path.join(profiler._run_path, d) for d in os.listdir(profiler._run_path)
+                  if os.path.isdir(os.path.join(profiler._run_path, d)))
+
+
+def test_scan_cycle_round_trip(graph, tmp_path):
+    profiler = CycleProfiler(0, str(tmp_path), interval=0.001)
+    with profiler.cycle("scan") as cycle:
+        cycle.record(replay=REPLAY_SCAN, graph=graph, min_profit=MIN_PROFIT)
+        with cycle.phase("compute"):
+            opportunities = graph.find_all_triangular_arbitrage(min_profit=MIN_PROFIT)
+            time.sleep(0.02)
+
+    [dump_path] = dump_dirs(profiler)
+    with open(os.path.join(dump_path, CYCLE_INFO_FILE), 'r') as f:
+        info = json.load(f)
+    assert info['replay'] == REPLAY_SCAN
+    assert info['timings']['compute_ms'] > 0
+    assert replay_cycle(dump_path) == opportunities
+
+    with open(os.path.join(dump_path, STACKS_FILE), 'r') as f:
+        stacks = f.read()
+    assert "find_all_triangular_arbitrage (binance_graph.py" in stacks
+    assert "stop (profiling.py" not in stacks
+
+
+def test_pnl_cycle_round_trip(graph, order_books_data, tmp_path):
+    profiler = CycleProfiler(0, str(tmp_path))
+    path = order_books_data['path']
+    for _ in range(2):
+        with profiler.cycle("pnl") as cycle:
+            cycle.record(replay=REPLAY_PNL, graph=graph, path=path, amount=AMOUNT)
+            cycle.record(order_books=order_books_data['order_books'])
+            pnl = graph.compute_pnl_arbitrage(path=path, amount=AMOUNT, order_books=order_books_data['order_books'])
+
+    dumps = dump_dirs(profiler)
+    assert len(dumps) == 2
+    # The same graph object is written only once per run
+    assert [f for f in os.listdir(profiler._run_path) if f.startswith("graph_")] == ["graph_1.json"]
+    for dump_path in dumps:
+        assert replay_cycle(dump_path) == pnl
+
+
+def test_failing_cycle_is_dumped_but_not_replayable(graph, order_books_data, tmp_path):
+    profiler = CycleProfiler(0, str(tmp_path))
+    with pytest.raises(ValueError):
+        with profiler.cycle("debug_depth") as cycle:
+            cycle.record(replay=REPLAY_PNL, graph=graph, path=order_books_data['path'], amount=AMOUNT)
+            raise ValueError("No valid trading pair found for USDT-BNB")
+
+    [dump_path] = dump_dirs(profiler)
+    with open(os.path.join(dump_path, CYCLE_INFO_FILE), 'r') as f:
+        info = json.load(f)
+    assert info['error'] == "ValueError: No valid trading pair found for USDT-BNB"
+    with pytest.raises(ValueError, match="no order books"):
+        replay_cycle(dump_path)
+
+
+def test_max_dumps(tmp_path):
+    profiler = CycleProfiler(0, str(tmp_path), max_dumps=2)
+    for _ in range(3):
+        with profiler.cycle("scan"):
+            pass
+
+    assert profiler.dump_count == 2
+    assert len(dump_dirs(profiler)) == 2
+
+
+def test_failed_dump_does_not_use_a_slot(tmp_path):
+    not_a_dir = tmp_path / "profiles"
+    not_a_dir.write_text("")
+    profiler = CycleProfiler(0, str(not_a_dir), max_dumps=1)
+    with profiler.cycle("scan"):
+        pass
+
+    assert profiler.dump_count == 0
+
+
+def test_disabled_profiler_writes_nothing(tmp_path):
+    profiler = CycleProfiler(None, str(tmp_path))
+    with profiler.cycle("scan"):
+        time.sleep(0.01)
+
+    assert os.listdir(tmp_path) == []